@@ -117,13 +117,16 @@ class QAManager:
 
             limit = max(1, limit) if isinstance(limit, int) else 5
 
-            knowledge = [
-                (
-                    self.embed_manager.paragraphs_embedding_store.store[res[0]].str,
-                    res[1],
-                )
-                for res in query_res
-            ]
+            # 按内容去重：同一文段可能被多条查询结果命中，重复进入prompt只会浪费token。
+            # query_res本身按相关性降序，去重后保留每个文段的最高分，顺序保持确定性
+            knowledge = []
+            seen_paragraphs = set()
+            for res in query_res:
+                paragraph = self.embed_manager.paragraphs_embedding_store.store[res[0]].str
+                if paragraph in seen_paragraphs:
+                    continue
+                seen_paragraphs.add(paragraph)
+                knowledge.append((paragraph, res[1]))
 
             # max_score = max([k[1] for k in knowledge]) if knowledge else None
             selected_knowledge = knowledge[:limit]
@@ -1,3 +1,4 @@
+import functools
 import traceback
 import time
 import asyncio
@@ -48,6 +49,17 @@ init_memory_retrieval_prompt()
 logger = get_logger("replyer")
 
 
+@functools.lru_cache(maxsize=1)
+def _personality_name_prefix() -> str:
+    """名字与别名在进程内不变，只拼接一次，保证各prompt中人设前缀字节一致"""
+    bot_name = global_config.bot.nickname
+    if global_config.bot.alias_names:
+        bot_nickname = f",也有人叫你{','.join(global_config.bot.alias_names)}"
+    else:
+        bot_nickname = ""
+    return f"你的名字是{bot_name}{bot_nickname}，你"
+
+
 class PrivateReplyer:
     def __init__(
         self,
@@ -511,12 +523,6 @@ class PrivateReplyer:
         return action_descriptions
 
     async def build_personality_prompt(self) -> str:
-        bot_name = global_config.bot.nickname
-        if global_config.bot.alias_names:
-            bot_nickname = f",也有人叫你{','.join(global_config.bot.alias_names)}"
-        else:
-            bot_nickname = ""
-
         # 获取基础personality
         prompt_personality = global_config.personality.personality
 
@@ -530,8 +536,7 @@ class PrivateReplyer:
             selected_state = random.choice(global_config.personality.states)
             prompt_personality = selected_state
 
-        prompt_personality = f"{prompt_personality};"
-        return f"你的名字是{bot_name}{bot_nickname}，你{prompt_personality}"
+        return f"{_personality_name_prefix()}{prompt_personality};"
 
     def _parse_chat_prompt_config_to_chat_id(self, chat_prompt_str: str) -> Optional[tuple[str, str]]:
         """
@@ -6,61 +6,69 @@ def init_replyer_prompt():
     Prompt("正在群里聊天", "chat_target_group2")
     Prompt("和{sender_name}聊天", "chat_target_private2")
 
+    # 模板统一为：稳定前缀（人设+固定规则）在前，可变内容（知识、聊天记录等）在后，
+    # 这样每次调用的prompt前缀字节一致，便于命中LLM供应商的prompt缓存
     Prompt(
-        """{knowledge_prompt}{tool_info_block}{extra_info_block}
+        """{identity}
+你正在qq群里聊天,现在请你读读之后给出的聊天记录，然后给出日常且口语化的回复，平淡一些，尽量简短一些。
+请注意把握聊天内容，不要回复的太有条理，可以有个性。
+{reply_style}
+请注意不要输出多余内容(包括前后缀，冒号和引号，括号，表情等)，只输出一句回复内容就好。
+不要输出多余内容(包括前后缀，冒号和引号，括号，表情包，at或 @等 )。
+
+{knowledge_prompt}{tool_info_block}{extra_info_block}
 {expression_habits_block}{memory_retrieval}{jargon_explanation}
 
-你正在qq群里聊天，下面是群里正在聊的内容，其中包含聊天记录和聊天中的图片
+下面是群里正在聊的内容，其中包含聊天记录和聊天中的图片
 其中标注 {bot_name}(你) 的发言是你自己的发言，请注意区分:
 {time_block}
 {dialogue_prompt}
 
 {reply_target_block}。
 {planner_reasoning}
-{identity}
-{chat_prompt}你正在群里聊天,现在请你读读之前的聊天记录，然后给出日常且口语化的回复，平淡一些，{mood_state}
-尽量简短一些。{keywords_reaction_prompt}请注意把握聊天内容，不要回复的太有条理，可以有个性。
-{reply_style}
-请注意不要输出多余内容(包括前后缀，冒号和引号，括号，表情等)，只输出一句回复内容就好。
-不要输出多余内容(包括前后缀，冒号和引号，括号，表情包，at或 @等 )。
+{chat_prompt}{mood_state}{keywords_reaction_prompt}
 现在，你说：""",
         "replyer_prompt",
     )
 
     Prompt(
-        """{knowledge_prompt}{tool_info_block}{extra_info_block}
+        """{identity}
+你正在和{sender_name}聊天,现在请你读读之后给出的聊天记录，然后给出日常且口语化的回复，平淡一些，尽量简短一些。
+请注意把握聊天内容，不要回复的太有条理，可以有个性。
+{reply_style}
+请注意不要输出多余内容(包括前后缀，冒号和引号，括号，表情等)，只输出回复内容。
+{moderation_prompt}不要输出多余内容(包括前后缀，冒号和引号，括号，表情包，at或 @等 )。
+
+{knowledge_prompt}{tool_info_block}{extra_info_block}
 {expression_habits_block}{memory_retrieval}{jargon_explanation}
 
-你正在和{sender_name}聊天，这是你们之前聊的内容:
+这是你们之前聊的内容:
 {time_block}
 {dialogue_prompt}
 
 {reply_target_block}。
 {planner_reasoning}
-{identity}
-{chat_prompt}你正在和{sender_name}聊天,现在请你读读之前的聊天记录，然后给出日常且口语化的回复，平淡一些，{mood_state}
-尽量简短一些。{keywords_reaction_prompt}请注意把握聊天内容，不要回复的太有条理，可以有个性。
-{reply_style}
-请注意不要输出多余内容(包括前后缀，冒号和引号，括号，表情等)，只输出回复内容。
-{moderation_prompt}不要输出多余内容(包括前后缀，冒号和引号，括号，表情包，at或 @等 )。""",
+{chat_prompt}{mood_state}{keywords_reaction_prompt}""",
         "private_replyer_prompt",
     )
 
     Prompt(
-        """{knowledge_prompt}{tool_info_block}{extra_info_block}
+        """{identity}
+你正在和{sender_name}聊天。请注意把握聊天内容，不要回复的太有条理，可以有个性。尽量简短一些。
+{reply_style}
+请注意不要输出多余内容(包括前后缀，冒号和引号，括号，表情等)，只输出回复内容。
+{moderation_prompt}不要输出多余内容(包括冒号和引号，括号，表情包，at或 @等 )。
+
+{knowledge_prompt}{tool_info_block}{extra_info_block}
 {expression_habits_block}{memory_retrieval}{jargon_explanation}
 
-你正在和{sender_name}聊天，这是你们之前聊的内容:
+这是你们之前聊的内容:
 {time_block}
 {dialogue_prompt}
 
 你现在想补充说明你刚刚自己的发言内容：{target}，原因是{reason}
 请你根据聊天内容，组织一条新回复。注意，{target} 是刚刚你自己的发言，你要在这基础上进一步发言，请按照你自己的角度来继续进行回复。注意保持上下文的连贯性。{mood_state}
-{identity}
-{chat_prompt}尽量简短一些。{keywords_reaction_prompt}请注意把握聊天内容，不要回复的太有条理，可以有个性。
-{reply_style}
-请注意不要输出多余内容(包括前后缀，冒号和引号，括号，表情等)，只输出回复内容。
-{moderation_prompt}不要输出多余内容(包括冒号和引号，括号，表情包，at或 @等 )。
+{chat_prompt}{keywords_reaction_prompt}
 """,
         "private_replyer_self_prompt",
     )
@@ -75,10 +75,10 @@ def replace_user_references(
     at_pattern = r"@<([^:<>]+):([^:<>]+)>"
     at_matches = list(re.finditer(at_pattern, content))
     if at_matches:
-        new_content = ""
+        parts: List[str] = []
         last_end = 0
         for m in at_matches:
-            new_content += content[last_end : m.start()]
+            parts.append(content[last_end : m.start()])
             aaa = m.group(1)
             bbb = m.group(2)
             try:
@@ -87,13 +87,13 @@ def replace_user_references(
                     at_person_name = f"{global_config.bot.nickname}(你)"
                 else:
                     at_person_name = name_resolver(platform, bbb) or aaa
-                new_content += f"@{at_person_name}"
+                parts.append(f"@{at_person_name}")
             except Exception:
                 # 如果解析失败，使用原始昵称
-                new_content += f"@{aaa}"
+                parts.append(f"@{aaa}")
             last_end = m.end()
-        new_content += content[last_end:]
-        content = new_content
+        parts.append(content[last_end:])
+        content = "".join(parts)
 
     # Telegram 文本 @username 的显示映射交由适配器或平台层处理；此处不做硬编码替换
 
@@ -394,6 +394,9 @@ def _build_readable_messages_internal(
         pic_id_mapping = {}
     current_pic_counter = pic_counter
     pic_description_cache: Dict[str, str] = {}
+    # 同一用户在一段历史里通常出现多次，按(platform, user_id)缓存名字解析结果，
+    # 避免每条消息都构建一次Person（内部含数据库查询）
+    person_name_cache: Dict[Tuple[str, str], Optional[str]] = {}
 
     # 创建时间戳到消息ID的映射，用于在消息前添加[id]标识符
     timestamp_to_id_mapping: Dict[float, str] = {}
@@ -459,10 +462,15 @@ def _build_readable_messages_internal(
         if not all([platform, user_id, timestamp is not None]):
             continue
 
-        person = Person(platform=platform, user_id=user_id)
+        person_cache_key = (platform, user_id)
+        if person_cache_key in person_name_cache:
+            resolved_person_name = person_name_cache[person_cache_key]
+        else:
+            resolved_person_name = Person(platform=platform, user_id=user_id).person_name
+            person_name_cache[person_cache_key] = resolved_person_name
         # 根据 replace_bot_name 参数决定是否替换机器人名称
         person_name = (
-            person.person_name or f"{user_nickname}" or (f"昵称：{user_cardname}" if user_cardname else "某人")
+            resolved_person_name or f"{user_nickname}" or (f"昵称：{user_cardname}" if user_cardname else "某人")
         )
         if replace_bot_name and (
             (platform == global_config.bot.platform and user_id == global_config.bot.qq_account)
@@ -532,9 +540,8 @@ def _build_readable_messages_internal(
             output_lines.append(f"{id_prefix}{readable_time}, {content}")
         else:
             output_lines.append(f"{id_prefix}{readable_time}, {name}: {content}")
-        output_lines.append("\n")  # 在每个消息块后添加换行，保持可读性
 
-    formatted_string = "".join(output_lines).strip()
+    formatted_string = "\n".join(output_lines).strip()
 
     # 返回格式化后的字符串、消息详情列表、图片映射字典和更新后的计数器
     return (
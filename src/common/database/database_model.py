@@ -336,6 +336,12 @@ class Expression(BaseModel):
 
     class Meta:
         table_name = "expression"
+        indexes = (
+            # 表达抽样热查询：WHERE chat_id IN (...) AND NOT rejected，并直接读取count
+            (("chat_id", "rejected", "count"), False),
+            # 表达学习按(chat_id, style)查找已有表达
+            (("chat_id", "style"), False),
+        )
 
 
 class Jargon(BaseModel):
@@ -496,6 +502,12 @@ def initialize_database(sync_constraints=False):
                     except Exception as e:
                         logger.error(f"删除字段 '{field_name}' 失败: {e}")
 
+                # 补建模型中定义但数据库里缺失的索引（CREATE INDEX IF NOT EXISTS，已有则跳过）
+                try:
+                    model._schema.create_indexes(safe=True)
+                except Exception as e:
+                    logger.error(f"为表 '{table_name}' 创建索引失败: {e}")
+
         # 如果启用了约束同步，执行约束检查和修复
         if sync_constraints:
             logger.debug("开始同步数据库字段约束...")
@@ -1,5 +1,6 @@
 import re
 import difflib
+import heapq
 import random
 from datetime import datetime
 from typing import Optional, List, Dict
@@ -107,7 +108,10 @@ def _compute_weights(population: List[Dict]) -> List[float]:
 
 def weighted_sample(population: List[Dict], k: int) -> List[Dict]:
     """
-    随机抽样函数
+    加权不放回随机抽样（Efraimidis–Spirakis A-Res 算法）
+
+    对每个元素生成key = -ln(U)/w（即指数分布采样），取key最小的k个，
+    等价于按权重不放回抽样。单次O(n)遍历即可完成，无需反复复制列表。
 
     Args:
         population: 总体数据列表
@@ -122,24 +126,8 @@ def weighted_sample(population: List[Dict], k: int) -> List[Dict]:
     if len(population) <= k:
         return population.copy()
 
-    selected: List[Dict] = []
-    population_copy = population.copy()
-
-    for _ in range(min(k, len(population_copy))):
-        weights = _compute_weights(population_copy)
-        total_weight = sum(weights)
-        if total_weight <= 0:
-            # 回退到均匀随机
-            idx = random.randint(0, len(population_copy) - 1)
-            selected.append(population_copy.pop(idx))
-            continue
-
-        threshold = random.uniform(0, total_weight)
-        cumulative = 0.0
-        for idx, weight in enumerate(weights):
-            cumulative += weight
-            if threshold <= cumulative:
-                selected.append(population_copy.pop(idx))
-                break
-
-    return selected
+    weights = _compute_weights(population)
+    # random.expovariate(w)即-ln(U)/w，权重越大key越小，被选中概率越高
+    keys = ((random.expovariate(weight), idx) for idx, weight in enumerate(weights) if weight > 0)
+    top_k = heapq.nsmallest(k, keys)
+    return [population[idx] for _, idx in top_k]
@@ -1,35 +1,46 @@
+import functools
 import json
+import random
 import time
 import hashlib
 
+from collections import OrderedDict
 from typing import List, Dict, Optional, Any, Tuple
 from json_repair import repair_json
+from peewee import fn
 
 from src.llm_models.utils_model import LLMRequest
 from src.config.config import global_config, model_config
 from src.common.logger import get_logger
+from src.common.database.database import db
 from src.common.database.database_model import Expression
+
 from src.chat.utils.prompt_builder import Prompt, global_prompt_manager
-from src.express.express_utils import weighted_sample
 
 logger = get_logger("expression_selector")
 
 
-def init_prompt():
-    expression_evaluation_prompt = """{chat_observe_info}
+@db.func("expr_sample_key")
+def _expr_sample_key(count, checked) -> float:
+    """A-Res加权抽样key：-ln(U)/w，权重越大key越小，排序后取前k行即为加权不放回抽样"""
+    try:
+        weight = max(float(count), 1.0) if count is not None else 1.0
+    except (TypeError, ValueError):
+        weight = 1.0
+    if checked:
+        weight *= 3.0
+    return random.expovariate(weight)
 
-你的名字是{bot_name}{target_message}
-{reply_reason_block}
 
-以下是可选的表达情境：
-{all_situations}
-
-请你分析聊天内容的语境、情绪、话题类型，从上述情境中选择最适合当前聊天情境的，最多{max_num}个情境。
+def init_prompt():
+    # 稳定前缀：人设与固定指令、评选标准、JSON示例。bot_name/max_num在进程内取值不变，
+    # 因此格式化后的前缀字节稳定，便于命中LLM供应商的prompt缓存
+    expression_evaluation_system = """你的名字是{bot_name}。请你分析聊天内容的语境、情绪、话题类型，从给出的可选表达情境中选择最适合当前聊天情境的，最多{max_num}个情境。
 考虑因素包括：
 1.聊天的情绪氛围（轻松、严肃、幽默等）
 2.话题类型（日常、技术、游戏、情感等）
 3.情境与当前语境的匹配度
-{target_message_extra_block}
+4.如果给出了你要回复的目标消息，考虑该目标消息
 
 请以JSON格式输出，只需要输出选中的情境编号：
 例如：
@@ -37,9 +48,20 @@ def init_prompt():
     "selected_situations": [2, 3, 5, 7, 19]
 }}
 
-请严格按照JSON格式输出，不要包含其他内容：
+请严格按照JSON格式输出，不要包含其他内容。
+"""
+    Prompt(expression_evaluation_system, "expression_evaluation_system")
+
+    # 可变部分：聊天上下文、目标消息与候选情境，始终拼在稳定前缀之后
+    expression_evaluation_user = """{chat_observe_info}{target_message}
+{reply_reason_block}
+
+以下是可选的表达情境：
+{all_situations}
+
+请严格按照JSON格式输出选中的情境编号：
 """
-    Prompt(expression_evaluation_prompt, "expression_evaluation_prompt")
+    Prompt(expression_evaluation_user, "expression_evaluation_user")
 
 
 class ExpressionSelector:
@@ -47,10 +69,56 @@ class ExpressionSelector:
         self.llm_model = LLMRequest(
             model_set=model_config.model_task_config.utils_small, request_type="expression.selector"
         )
+        # 表达共享组配置在进程内基本静态，启动时构建一次chat_id -> 组成员的反查索引，
+        # 避免每次get_related_chat_ids都遍历所有组并重复计算MD5
+        self._all_group_chat_ids: Optional[List[str]] = None
+        self._group_index: Dict[str, List[str]] = {}
+        self._build_group_index()
+        # 预绑定配置查询方法，热路径上省去每次的属性链解析
+        self._get_expr_cfg = global_config.expression.get_expression_config_for_chat
+        # LLM选择结果的进程内LRU缓存：消息爆发期间相同上下文+相同抽样结果会在短时间内重现，
+        # 命中时直接跳过网络往返。条目带TTL，过期视为未命中，
+        # 避免长期复用已经通过webui被拒绝或删除的表达
+        self._resp_cache: "OrderedDict[str, Tuple[float, List[Dict[str, Any]], List[int]]]" = OrderedDict()
+        self._resp_cache_maxsize = 256
+        self._resp_cache_ttl = 60.0
+        # 表达开关查询结果的TTL缓存：热聊天每条消息都会查询一次，配置短期内不会变化
+        self._use_expr_cache: Dict[str, Tuple[float, bool]] = {}
+        self._use_expr_cache_ttl = 60.0
+        self._use_expr_cache_maxsize = 4096
+        # 表达数量不足的负缓存：新聊天积累期内跳过必然失败的DB查询
+        self._insufficient_until: Dict[str, float] = {}
+        self._insufficient_ttl = 30.0
+        # prompt模板缓存：模板只在本模块全局注册、不会被上下文覆盖，
+        # 首次取到后稳态路径不再走异步管理器；稳定前缀按max_num缓存格式化结果
+        self._prompt_tmpls: Optional[Tuple[str, str]] = None
+        self._system_prompt_cache: Dict[int, str] = {}
+
+    def _build_group_index(self):
+        """遍历expression_groups配置，预计算每个成员chat_id对应的组成员列表"""
+        groups = global_config.expression.expression_groups
+
+        # 检查是否存在全局共享组（包含"*"的组）
+        if any("*" in group for group in groups):
+            all_chat_ids = set()
+            for group in groups:
+                for stream_config_str in group:
+                    if chat_id_candidate := self._parse_stream_config_to_chat_id(stream_config_str):
+                        all_chat_ids.add(chat_id_candidate)
+            self._all_group_chat_ids = list(all_chat_ids)
+            return
+
+        for group in groups:
+            group_chat_ids = []
+            for stream_config_str in group:
+                if chat_id_candidate := self._parse_stream_config_to_chat_id(stream_config_str):
+                    group_chat_ids.append(chat_id_candidate)
+            for member_chat_id in group_chat_ids:
+                self._group_index[member_chat_id] = group_chat_ids
 
     def can_use_expression_for_chat(self, chat_id: str) -> bool:
         """
-        检查指定聊天流是否允许使用表达
+        检查指定聊天流是否允许使用表达（结果带TTL缓存）
 
         Args:
             chat_id: 聊天流ID
@@ -58,14 +126,22 @@ class ExpressionSelector:
         Returns:
             bool: 是否允许使用表达
         """
+        now = time.time()
+        cached = self._use_expr_cache.get(chat_id)
+        if cached is not None and now < cached[0]:
+            return cached[1]
         try:
-            use_expression, _, _ = global_config.expression.get_expression_config_for_chat(chat_id)
-            return use_expression
+            use_expression = bool(self._get_expr_cfg(chat_id)[0])
         except Exception as e:
             logger.error(f"检查表达使用权限失败: {e}")
             return False
+        if len(self._use_expr_cache) >= self._use_expr_cache_maxsize:
+            self._use_expr_cache.clear()
+        self._use_expr_cache[chat_id] = (now + self._use_expr_cache_ttl, use_expression)
+        return use_expression
 
     @staticmethod
+    @functools.lru_cache(maxsize=1024)
     def _parse_stream_config_to_chat_id(stream_config_str: str) -> Optional[str]:
         """解析'platform:id:type'为chat_id（与get_stream_id一致）"""
         try:
@@ -87,29 +163,10 @@ class ExpressionSelector:
 
     def get_related_chat_ids(self, chat_id: str) -> List[str]:
         """根据expression_groups配置，获取与当前chat_id相关的所有chat_id（包括自身）"""
-        groups = global_config.expression.expression_groups
-
-        # 检查是否存在全局共享组（包含"*"的组）
-        global_group_exists = any("*" in group for group in groups)
-
-        if global_group_exists:
-            # 如果存在全局共享组，则返回所有可用的chat_id
-            all_chat_ids = set()
-            for group in groups:
-                for stream_config_str in group:
-                    if chat_id_candidate := self._parse_stream_config_to_chat_id(stream_config_str):
-                        all_chat_ids.add(chat_id_candidate)
-            return list(all_chat_ids) if all_chat_ids else [chat_id]
-
-        # 否则使用现有的组逻辑
-        for group in groups:
-            group_chat_ids = []
-            for stream_config_str in group:
-                if chat_id_candidate := self._parse_stream_config_to_chat_id(stream_config_str):
-                    group_chat_ids.append(chat_id_candidate)
-            if chat_id in group_chat_ids:
-                return group_chat_ids
-        return [chat_id]
+        # 如果存在全局共享组，则返回所有可用的chat_id
+        if self._all_group_chat_ids is not None:
+            return self._all_group_chat_ids or [chat_id]
+        return self._group_index.get(chat_id, [chat_id])
 
     def _random_expressions(self, chat_id: str, total_num: int) -> List[Dict[str, Any]]:
         """
@@ -127,31 +184,39 @@ class ExpressionSelector:
             related_chat_ids = self.get_related_chat_ids(chat_id)
 
             # 优化：一次性查询所有相关chat_id的表达方式，排除 rejected=1 的表达
-            style_query = Expression.select().where(
-                (Expression.chat_id.in_(related_chat_ids)) & (~Expression.rejected)
+            # 加权抽样直接在SQL中完成（按A-Res key排序取前total_num行），只取k行而非全表；
+            # 只取需要的列并用.dicts()跳过peewee模型实例化
+            style_query = (
+                Expression.select(
+                    Expression.id,
+                    Expression.situation,
+                    Expression.style,
+                    Expression.count,
+                    Expression.checked,
+                    Expression.last_active_time,
+                    Expression.chat_id,
+                    Expression.create_date,
+                )
+                .where((Expression.chat_id.in_(related_chat_ids)) & (~Expression.rejected))
+                .order_by(fn.expr_sample_key(Expression.count, Expression.checked))
+                .limit(total_num)
             )
 
             style_exprs = [
                 {
-                    "id": expr.id,
-                    "situation": expr.situation,
-                    "style": expr.style,
-                    "last_active_time": expr.last_active_time,
-                    "source_id": expr.chat_id,
-                    "create_date": expr.create_date if expr.create_date is not None else expr.last_active_time,
-                    "count": expr.count if getattr(expr, "count", None) is not None else 1,
-                    "checked": expr.checked if getattr(expr, "checked", None) is not None else False,
+                    "id": row["id"],
+                    "situation": row["situation"],
+                    "style": row["style"],
+                    "last_active_time": row["last_active_time"],
+                    "source_id": row["chat_id"],
+                    "create_date": row["create_date"] if row["create_date"] is not None else row["last_active_time"],
+                    "count": row["count"] if row["count"] is not None else 1,
+                    "checked": row["checked"] if row["checked"] is not None else False,
                 }
-                for expr in style_query
+                for row in style_query.dicts()
             ]
 
-            # 随机抽样
-            if style_exprs:
-                selected_style = weighted_sample(style_exprs, total_num)
-            else:
-                selected_style = []
-
-            return selected_style
+            return style_exprs
 
         except Exception as e:
             logger.error(f"随机选择表达方式失败: {e}")
@@ -209,35 +274,53 @@ class ExpressionSelector:
             Tuple[List[Dict[str, Any]], List[int]]: 选中的表达方式列表和ID列表
         """
         try:
+            # 表达数量不足的聊天在短时间内不会有变化，积累期内直接跳过DB查询
+            if time.time() < self._insufficient_until.get(chat_id, 0):
+                return [], []
+
             # 1. 使用随机抽样选择表达方式
             style_exprs = self._random_expressions(chat_id, 20)
 
             if len(style_exprs) < 10:
                 logger.info(f"聊天流 {chat_id} 表达方式正在积累中")
+                self._insufficient_until[chat_id] = time.time() + self._insufficient_ttl
                 return [], []
 
-            # 2. 构建所有表达方式的索引和情境列表
-            all_expressions: List[Dict[str, Any]] = []
-            all_situations: List[str] = []
-
-            # 添加style表达方式
-            for expr in style_exprs:
-                expr = expr.copy()
-                all_expressions.append(expr)
-                all_situations.append(f"{len(all_expressions)}.当 {expr['situation']} 时，使用 {expr['style']}")
+            # 按id排序，保证同一批抽样结果生成字节一致的prompt
+            style_exprs.sort(key=lambda expr: expr["id"])
 
-            if not all_expressions:
-                logger.warning("没有找到可用的表达方式")
-                return [], []
-
-            all_situations_str = "\n".join(all_situations)
+            # 相同上下文+相同抽样结果直接复用上次的LLM选择结果；
+            # 没有target_message的调用复现率低，不参与缓存，避免一次性请求污染缓存槽位
+            cache_key = None
+            if target_message:
+                cache_key = hashlib.md5(
+                    json.dumps(
+                        [chat_info, target_message, reply_reason or "", [expr["id"] for expr in style_exprs]],
+                        ensure_ascii=False,
+                    ).encode()
+                ).hexdigest()
+                if (cached := self._resp_cache.get(cache_key)) is not None:
+                    expiry_ts, valid_expressions, selected_ids = cached
+                    if time.time() < expiry_ts:
+                        self._resp_cache.move_to_end(cache_key)
+                        if valid_expressions:
+                            self.update_expressions_last_active_time(valid_expressions)
+                        logger.debug(f"命中表达选择缓存，跳过LLM调用（{len(valid_expressions)}个表达方式）")
+                        return valid_expressions, selected_ids
+                    # 过期条目视为未命中，直接清除
+                    del self._resp_cache[cache_key]
+
+            # 2. 构建所有表达方式的索引和情境列表（抽样结果本身就是新构建的list/dict，直接引用即可）
+            all_expressions: List[Dict[str, Any]] = style_exprs
+
+            all_situations_str = "\n".join(
+                f"{i + 1}.当 {expr['situation']} 时，使用 {expr['style']}" for i, expr in enumerate(all_expressions)
+            )
 
             if target_message:
-                target_message_str = f"，现在你想要对这条消息进行回复：“{target_message}”"
-                target_message_extra_block = "4.考虑你要回复的目标消息"
+                target_message_str = f"现在你想要对这条消息进行回复：“{target_message}”"
             else:
                 target_message_str = ""
-                target_message_extra_block = ""
 
             chat_context = f"以下是正在进行的聊天内容：{chat_info}"
 
@@ -248,16 +331,26 @@ class ExpressionSelector:
             else:
                 reply_reason_block = ""
 
-            # 3. 构建prompt（只包含情境，不包含完整的表达方式）
-            prompt = (await global_prompt_manager.get_prompt_async("expression_evaluation_prompt")).format(
-                bot_name=global_config.bot.nickname,
+            # 3. 构建prompt（稳定前缀在前、可变内容在后，只包含情境，不包含完整的表达方式）
+            if self._prompt_tmpls is None:
+                self._prompt_tmpls = (
+                    await global_prompt_manager.get_prompt_async("expression_evaluation_system"),
+                    await global_prompt_manager.get_prompt_async("expression_evaluation_user"),
+                )
+            system_tmpl, user_tmpl = self._prompt_tmpls
+            if (system_prompt := self._system_prompt_cache.get(max_num)) is None:
+                system_prompt = system_tmpl.format(
+                    bot_name=global_config.bot.nickname,
+                    max_num=max_num,
+                )
+                self._system_prompt_cache[max_num] = system_prompt
+            user_prompt = user_tmpl.format(
                 chat_observe_info=chat_context,
                 all_situations=all_situations_str,
-                max_num=max_num,
                 target_message=target_message_str,
-                target_message_extra_block=target_message_extra_block,
                 reply_reason_block=reply_reason_block,
             )
+            prompt = f"{system_prompt}\n{user_prompt}"
 
             # 4. 调用LLM
             content, (reasoning_content, model_name, _) = await self.llm_model.generate_response_async(prompt=prompt)
@@ -268,10 +361,12 @@ class ExpressionSelector:
                 logger.warning("LLM返回空结果")
                 return [], []
 
-            # 5. 解析结果
-            result = repair_json(content)
-            if isinstance(result, str):
-                result = json.loads(result)
+            # 5. 解析结果：模型绝大多数情况下输出合法JSON，先走原生解析，
+            # 失败时才进入修复路径（skip_json_loads避免repair_json内部再预解析一次）
+            try:
+                result = json.loads(content)
+            except json.JSONDecodeError:
+                result = repair_json(content, skip_json_loads=True, return_objects=True)
 
             if not isinstance(result, dict) or "selected_situations" not in result:
                 logger.error("LLM返回格式错误")
@@ -293,6 +388,16 @@ class ExpressionSelector:
             if valid_expressions:
                 self.update_expressions_last_active_time(valid_expressions)
 
+            # 写入LRU缓存，TTL内重复的选择请求不再走LLM
+            if cache_key is not None:
+                self._resp_cache[cache_key] = (
+                    time.time() + self._resp_cache_ttl,
+                    valid_expressions,
+                    selected_ids,
+                )
+                if len(self._resp_cache) > self._resp_cache_maxsize:
+                    self._resp_cache.popitem(last=False)
+
             logger.debug(f"从{len(all_expressions)}个情境中选择了{len(valid_expressions)}个")
             return valid_expressions, selected_ids
 
@@ -304,26 +409,17 @@ class ExpressionSelector:
         """对一批表达方式更新last_active_time"""
         if not expressions_to_update:
             return
-        updates_by_key = {}
-        for expr in expressions_to_update:
-            source_id: str = expr.get("source_id")  # type: ignore
-            situation: str = expr.get("situation")  # type: ignore
-            style: str = expr.get("style")  # type: ignore
-            if not source_id or not situation or not style:
-                logger.warning(f"表达方式缺少必要字段，无法更新: {expr}")
-                continue
-            key = (source_id, situation, style)
-            if key not in updates_by_key:
-                updates_by_key[key] = expr
-        for chat_id, situation, style in updates_by_key:
-            query = Expression.select().where(
-                (Expression.chat_id == chat_id) & (Expression.situation == situation) & (Expression.style == style)
+        # id全局唯一，直接按id去重即可，无需拼(source_id, situation, style)元组
+        ids = {expr_id for expr in expressions_to_update if (expr_id := expr.get("id")) is not None}
+        if not ids:
+            logger.warning(f"表达方式缺少id，无法更新: {expressions_to_update}")
+            return
+        # 单条批量UPDATE代替逐行select+save，2N条语句变为1条
+        with db.atomic():
+            updated_count = (
+                Expression.update(last_active_time=time.time()).where(Expression.id.in_(list(ids))).execute()
             )
-            if query.exists():
-                expr_obj = query.get()
-                expr_obj.last_active_time = time.time()
-                expr_obj.save()
-                logger.debug("表达方式激活: 更新last_active_time in db")
+        logger.debug(f"表达方式激活: 批量更新{updated_count}条last_active_time")
 
 
 init_prompt()